@@ -1,109 +1,253 @@
 import os
 import io
+import codecs
+import hashlib
+import secrets
+import time
+import base64
 import argparse
 import webbrowser
-import math
 from datetime import datetime # To automatically get the current date
-from threading import Timer
+from threading import Timer, Lock
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from flask import Flask, render_template, request, flash, jsonify, session, redirect, url_for, Response
+from flask.json.provider import JSONProvider
+from flask.sessions import SecureCookieSessionInterface
 from weasyprint import HTML
+import numpy as np
+import pandas as pd
+import orjson
+from matplotlib.figure import Figure
+
+class OrjsonProvider(JSONProvider):
+    """ JSON provider backed by orjson, which also serializes the NumPy chart columns directly. """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+class OrjsonSessionSerializer:
+    """ Session cookie serializer without Flask's type tagging; the session only holds plain JSON values. """
+    def dumps(self, value):
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+
+    def loads(self, value):
+        return orjson.loads(value)
+
+class OrjsonSessionInterface(SecureCookieSessionInterface):
+    serializer = OrjsonSessionSerializer()
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.session_interface = OrjsonSessionInterface()
 app.secret_key = 'a_final_secret_key_that_is_very_secure'
 CMD_FILE_DATA = None
 
+# Limits shared by the server-side stores below: max entries per store and entry lifetime in seconds.
+CACHE_SIZE = 32
+CACHE_TTL = 3600
+CACHE_LOCK = Lock()
+# Processed runs keyed by file hash.
+RESULT_CACHE = OrderedDict()
+# Reports keyed by the token kept in the session cookie.
+REPORT_STORE = OrderedDict()
+# PDF renders run off the request thread; jobs are keyed by report token so repeated exports reuse them.
+PDF_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+PDF_JOBS = OrderedDict()
+
+RAD_S_TO_RPM, W_TO_HP, MIN_RPM = 9.5493, 1.0 / 745.7, 5500
+RPM_COL, TQ_COL, PWR_COL = 'RPM1_Motor_(rad/s)', 'Motor_Torque_(N.m)', 'Power_(W)'
+HEADER_KEYS = frozenset(("Gear_Ratio", "Roller_Diameter", "Roller_Mass", "Actual_MOI"))
+CURVE_FIT_MARKER, COAST_DOWN_MARKER, COLUMNS_ROW_PREFIX = 'PRIMARY_CHANNEL_CURVE_FIT_DATA', 'FULL_SET_COAST_DOWN_FIT_DATA', 'Time_(Sec)'
+
+def round2(values):
+    """ np.round(values, 2), but correctly rounded like Python's round() for the values that sit near a .xx5 tie. """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    rounded[near_tie] = [round(v, 2) for v in values[near_tie].tolist()]
+    return rounded
+
+def find_column_indices(columns_row):
+    """ Resolves the RPM, torque and power column positions from the column header row. """
+    headers = columns_row.split()
+    return headers.index(RPM_COL), headers.index(TQ_COL), headers.index(PWR_COL)
+
+def parse_sdp_stream(fp):
+    """ Parses a SimpleDyno (.sdp) file from a binary stream without buffering the whole file. """
+    # codecs' reader only needs fp.read(); io.TextIOWrapper also wants readable(), which SpooledTemporaryFile lacks before Python 3.11
+    return parse_sdp_text(codecs.getreader('utf-8')(fp))
+
 def parse_sdp_file(file_content):
+    """ Parses the already decoded content of a SimpleDyno (.sdp) file. """
+    return parse_sdp_text(io.StringIO(file_content))
+
+def read_until_marker(text, marker, chunk_size=64 * 1024):
+    """ Reads a text stream up to the line starting with marker (leading whitespace allowed), locating it chunk by chunk with str.find. """
+    buf, start = '', 0
+    while True:
+        pos = buf.find(marker, start)
+        while pos != -1:
+            line_start = buf.rfind('\n', 0, pos) + 1
+            if not buf[line_start:pos].strip(): return buf[:line_start]
+            pos = buf.find(marker, pos + 1)
+        chunk = text.read(chunk_size)
+        if not chunk: return buf
+        start = max(0, len(buf) - len(marker) + 1)
+        buf += chunk
+
+def parse_sdp_text(text):
     """
     Parses a SimpleDyno (.sdp) file with robust, multi-stage header detection.
+    The curve fit data table is handed to pandas in one block instead of being converted row by row.
     """
-    lines = file_content.splitlines()
-    config_data, performance_data = {}, []
+    config_data = {}
     
-    header_keys = ["Gear_Ratio", "Roller_Diameter", "Roller_Mass", "Actual_MOI"]
-    for line in lines:
-        if ":" in line:
-            key, val = line.split(":", 1)
-            if key.strip() in header_keys:
-                config_data[key.strip()] = val.strip()
-        if line.strip() == 'PRIMARY_CHANNEL_CURVE_FIT_DATA':
+    # Header lines are scanned one by one: 'header' -> 'data_wait_cols' at the curve fit marker -> stop at the column row (or the coast down marker)
+    phase, columns_row = 'header', None
+    for line in text:
+        if phase == 'header':
+            if line.strip() == CURVE_FIT_MARKER:
+                phase = 'data_wait_cols'
+            elif ":" in line:
+                key, val = line.split(":", 1)
+                key = key.strip()
+                if key in HEADER_KEYS: config_data[key] = val.strip()
+        elif line.lstrip().startswith(COLUMNS_ROW_PREFIX):
+            columns_row = line.strip(); break
+        elif line.lstrip().startswith(COAST_DOWN_MARKER):
             break
             
-    data_started = False
-    header_found = False
-    rpm_col, tq_col, pwr_col = 'RPM1_Motor_(rad/s)', 'Motor_Torque_(N.m)', 'Power_(W)'
-    rpm_idx, tq_idx, pwr_idx = -1, -1, -1
-    
-    for line in lines:
-        line = line.strip()
-        if line == 'PRIMARY_CHANNEL_CURVE_FIT_DATA':
-            data_started = True; continue
-        if not data_started: continue
-        if line.startswith('FULL_SET_COAST_DOWN_FIT_DATA'): break
-        
-        if not header_found and line.startswith('Time_(Sec)'):
-            headers = line.split()
-            try:
-                rpm_idx, tq_idx, pwr_idx = headers.index(rpm_col), headers.index(tq_col), headers.index(pwr_col)
-                header_found = True
-            except ValueError as e:
-                flash(f"Critical Error: A required column was not found: {e}"); return None
-            continue
-
-        if header_found and line:
-            values = line.split()
-            if len(values) <= max(rpm_idx, tq_idx, pwr_idx): continue
-            try:
-                rpm = float(values[rpm_idx].replace(',', '.')) * 9.5493
-                if rpm < 5500: continue
-                performance_data.append({
-                    'rpm': round(rpm),
-                    'torque': round(float(values[tq_idx].replace(',', '.')), 2),
-                    'hp': round(float(values[pwr_idx].replace(',', '.')) / 745.7, 2)
-                })
-            except (ValueError, IndexError): continue
-
-    if not performance_data:
-        flash("Parsing complete, but no data points were found above 5500 RPM."); return None
-    return {"config": config_data, "data": performance_data}
+    if columns_row is None:
+        flash(f"Parsing complete, but no data points were found above {MIN_RPM} RPM."); return None
+
+    try:
+        rpm_idx, tq_idx, pwr_idx = find_column_indices(columns_row)
+    except ValueError as e:
+        flash(f"Critical Error: A required column was not found: {e}"); return None
+
+    # The data rows go to pandas untouched; it skips surrounding whitespace and blank lines itself
+    table, usecols = read_until_marker(text, COAST_DOWN_MARKER), [rpm_idx, tq_idx, pwr_idx]
+    # SimpleDyno writes decimals in the machine's locale; fields are whitespace separated, so any ',' is a decimal comma
+    decimal = ',' if ',' in table else '.'
+    # Naming every column pads short rows with NaN (dropped by the mask below) instead of failing the usecols check
+    read_kwargs = dict(sep=r'\s+', engine='c', header=None, names=range(len(columns_row.split())), usecols=usecols, on_bad_lines='skip')
+    try:
+        df = pd.read_csv(io.StringIO(table), decimal=decimal, dtype=np.float64, **read_kwargs)
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame(columns=usecols, dtype=np.float64)
+    except ValueError:
+        # A malformed value in one of the columns; coerce per value so only the bad rows are dropped
+        df = pd.read_csv(io.StringIO(table), dtype=str, **read_kwargs)
+        df = df.apply(lambda col: pd.to_numeric(col.str.replace(decimal, '.', regex=False), errors='coerce'))
+
+    # One boolean mask drops both the low RPM region and rows with missing values
+    rpm, torque, hp = df[rpm_idx].to_numpy() * RAD_S_TO_RPM, df[tq_idx].to_numpy(), df[pwr_idx].to_numpy()
+    mask = (rpm >= MIN_RPM) & ~np.isnan(torque) & ~np.isnan(hp)
+    rpm, torque, hp = rpm[mask], torque[mask], hp[mask] * W_TO_HP
+
+    if not len(rpm):
+        flash(f"Parsing complete, but no data points were found above {MIN_RPM} RPM."); return None
+    return {"config": config_data, "data": {'rpm': np.rint(rpm).astype(np.int32), 'torque': round2(torque), 'hp': round2(hp)}}
 
 def aggregate_data_by_rpm(data, increment=500):
     """ Aggregates performance data into bins of a specified RPM increment. """
-    if not data: return []
-    bins = {}
-    for point in data:
-        bin_key = math.floor(point['rpm'] / increment) * increment
-        if bin_key not in bins:
-            bins[bin_key] = {'torque': [], 'hp': []}
-        bins[bin_key]['torque'].append(point['torque'])
-        bins[bin_key]['hp'].append(point['hp'])
-        
-    aggregated_results = []
-    for rpm_key in sorted(bins.keys()):
-        torques, hps = bins[rpm_key]['torque'], bins[rpm_key]['hp']
-        avg_torque, avg_hp = sum(torques) / len(torques), sum(hps) / len(hps)
-        aggregated_results.append({'rpm': rpm_key, 'torque': round(avg_torque, 2), 'hp': round(avg_hp, 2)})
-    return aggregated_results
-
-def process_file_content(content, filename):
-    """ Processes the raw file content, parses it, and calculates all necessary metrics. """
-    parsed = parse_sdp_file(content)
-    if not parsed or not parsed.get("data"): return None
+    if not len(data['rpm']): return []
+    df = pd.DataFrame({'rpm': (data['rpm'] // increment).astype(np.int32) * increment, 'torque': data['torque'], 'hp': data['hp']})
+    aggregated = df.groupby('rpm', sort=True, as_index=False).agg(torque=('torque', 'mean'), hp=('hp', 'mean'))
+    # Only a handful of bins: use Python's correctly rounded round(), np.round's scale-then-rint differs on ties like 7.405
+    return [{'rpm': row['rpm'], 'torque': round(row['torque'], 2), 'hp': round(row['hp'], 2)} for row in aggregated.to_dict('records')]
+
+def process_file_content(fp, filename):
+    """ Processes a binary file stream, parses it, and calculates all necessary metrics. """
+    parsed = parse_sdp_stream(fp)
+    if not parsed: return None
     data = parsed["data"]
+    rpm, torque, hp = data['rpm'], data['torque'], data['hp']
+    raw_data = [{'rpm': r, 'torque': t, 'hp': h} for r, t, h in zip(rpm.tolist(), torque.tolist(), hp.tolist())]
     return {
-        "config": parsed["config"], "data_points_count": len(data),
-        "peak_power": max(data, key=lambda x: x['hp']),
-        "peak_torque": max(data, key=lambda x: x['torque']),
-        "torque_data": [{'x': r['rpm'], 'y': r['torque']} for r in data],
-        "hp_data": [{'x': r['rpm'], 'y': r['hp']} for r in data],
-        "raw_data": data, "filename": filename,
-        "aggregated_data": aggregate_data_by_rpm(data)
+        "config": parsed["config"], "data_points_count": len(raw_data),
+        "peak_power": raw_data[int(hp.argmax())], "peak_torque": raw_data[int(torque.argmax())],
+        "chart": {'rpm': rpm, 'torque': torque, 'hp': hp}, "raw_data": raw_data,
+        "filename": filename, "aggregated_data": aggregate_data_by_rpm(data)
     }
 
+def cache_get(cache, key):
+    """ Returns a live entry from one of the server-side stores, dropping it once it has expired. """
+    if not key: return None
+    with CACHE_LOCK:
+        entry = cache.get(key)
+        if entry is None: return None
+        if time.monotonic() - entry[0] > CACHE_TTL:
+            del cache[key]; return None
+        cache.move_to_end(key); return entry[1]
+
+def cache_put(cache, key, value):
+    """ Stores an entry, evicting expired entries and then the least recently used ones beyond CACHE_SIZE. """
+    now = time.monotonic()
+    with CACHE_LOCK:
+        cache[key] = (now, value); cache.move_to_end(key)
+        while cache and (len(cache) > CACHE_SIZE or now - next(iter(cache.values()))[0] > CACHE_TTL):
+            cache.popitem(last=False)
+
+def process_file_cached(fp, filename):
+    """ Processes a seekable binary stream, reusing the result of an identical earlier upload. """
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: fp.read(64 * 1024), b''): digest.update(chunk)
+    digest.update(filename.encode('utf-8'))
+    key = digest.hexdigest()
+    result = cache_get(RESULT_CACHE, key)
+    if result: return result
+    fp.seek(0)
+    result = process_file_content(fp, filename)
+    if result: cache_put(RESULT_CACHE, key, result)
+    return result
+
+def store_report(report_data):
+    """ Keeps a report server-side and returns the token that identifies it in the session. """
+    token = secrets.token_urlsafe(16)
+    cache_put(REPORT_STORE, token, report_data)
+    return token
+
+def render_chart_png(main_run, comparison_run=None):
+    """ Draws the torque/power vs. RPM chart server-side (Agg canvas) for the PDF report. """
+    fig = Figure(figsize=(10, 5.5), dpi=120)
+    ax = fig.add_subplot()
+    runs = [(main_run, dict(linestyle='-', marker='o', markersize=3, linewidth=2.5, alpha=1.0))]
+    if comparison_run: runs.append((comparison_run, dict(linestyle='--', marker='x', markersize=4, linewidth=2, alpha=0.4)))
+    for run, style in runs:
+        chart = run['chart']
+        ax.plot(chart['rpm'], chart['torque'], color='#007bff', label=f"Torque ({run['filename']})", **style)
+        ax.plot(chart['rpm'], chart['hp'], color='#dc3545', label=f"Power ({run['filename']})", **style)
+    ax.set_xlabel('Motor RPM'); ax.set_ylabel('Torque (N·m) / Power (HP)'); ax.set_ylim(bottom=0)
+    ax.grid(color='#e0e0e0'); ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.12), ncol=len(runs) * 2, frameon=False)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+def render_report_pdf(report_data, base_url):
+    """ Builds the PDF report; runs on the PDF executor. """
+    chart_image = "data:image/png;base64," + base64.b64encode(
+        render_chart_png(report_data.get('main_run'), report_data.get('comparison_run'))).decode('ascii')
+    with app.app_context():
+        # Render the dedicated report template.
+        # We no longer need to pass a special logo_path.
+        html_string = render_template('report.html', 
+                               main_run=report_data.get('main_run'), 
+                               comparison_run=report_data.get('comparison_run'), 
+                               meta=report_data.get('meta'),
+                               chart_image=chart_image)
+    
+    # THE FIX: Use base_url to tell WeasyPrint how to find '/static/logo.png'
+    return HTML(string=html_string, base_url=base_url).write_pdf()
+
 @app.route('/')
 def main_page():
     global CMD_FILE_DATA
     if CMD_FILE_DATA:
-        session['report_data'] = CMD_FILE_DATA
+        session['report_token'] = store_report(CMD_FILE_DATA)
         data = CMD_FILE_DATA; CMD_FILE_DATA = None
         return render_template('results.html', **data)
     return render_template('index.html')
@@ -121,41 +265,49 @@ def upload_file_handler():
         'test_date': datetime.now().strftime('%Y-%m-%d %H:%M')
     }
     
-    main_run_data = process_file_content(io.StringIO(main_file.stream.read().decode("utf-8")).read(), main_file.filename)
+    main_run_data = process_file_cached(main_file.stream, main_file.filename)
     if not main_run_data: return render_template('index.html')
     
     comp_run_data = None
     comp_file = request.files.get('comparison_file')
     if comp_file and comp_file.filename != '':
-        comp_run_data = process_file_content(io.StringIO(comp_file.stream.read().decode("utf-8")).read(), comp_file.filename)
+        comp_run_data = process_file_cached(comp_file.stream, comp_file.filename)
     
-    # Store all data in the session for the PDF export
-    session['report_data'] = {
+    # Keep the report server-side for the PDF export; the session cookie only carries its token
+    session['report_token'] = store_report({
         'main_run': main_run_data, 
         'comparison_run': comp_run_data,
         'meta': report_meta 
-    }
+    })
     return render_template('results.html', main_run=main_run_data, comparison_run=comp_run_data, meta=report_meta)
 
 @app.route('/export-pdf', methods=['POST'])
 def export_pdf():
-    report_data = session.get('report_data')
-    chart_image = request.form.get('chartImage')
-    if not report_data or not chart_image:
-        flash("No data available to generate a report."); return redirect(url_for('main_page'))
-
-    # Render the dedicated report template.
-    # We no longer need to pass a special logo_path.
-    html_string = render_template('report.html', 
-                           main_run=report_data.get('main_run'), 
-                           comparison_run=report_data.get('comparison_run'), 
-                           meta=report_data.get('meta'),
-                           chart_image=chart_image)
-    
-    # THE FIX: Use base_url to tell WeasyPrint how to find '/static/logo.png'
-    pdf = HTML(string=html_string, base_url=request.url_root).write_pdf()
-    
-    return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': 'attachment;filename=dyno_report.pdf'})
+    token = session.get('report_token')
+    report_data = cache_get(REPORT_STORE, token)
+    if not report_data:
+        return jsonify({'error': "No data available to generate a report."}), 400
+
+    job_id = hashlib.blake2b(token.encode('utf-8'), digest_size=16).hexdigest()
+    job = cache_get(PDF_JOBS, job_id)
+    if job is None or (job.done() and job.exception()):  # Failed renders are retried on the next click
+        cache_put(PDF_JOBS, job_id, PDF_EXECUTOR.submit(render_report_pdf, report_data, request.url_root))
+    return jsonify({'job_id': job_id, 'status_url': url_for('export_pdf_status', job_id=job_id),
+                    'download_url': url_for('export_pdf_download', job_id=job_id)})
+
+@app.route('/export-pdf/status/<job_id>')
+def export_pdf_status(job_id):
+    job = cache_get(PDF_JOBS, job_id)
+    if job is None: return jsonify({'error': "Unknown or expired export job."}), 404
+    if job.done() and job.exception(): return jsonify({'done': True, 'error': f"PDF generation failed: {job.exception()}"})
+    return jsonify({'done': job.done()})
+
+@app.route('/export-pdf/download/<job_id>')
+def export_pdf_download(job_id):
+    job = cache_get(PDF_JOBS, job_id)
+    if job is None or not job.done() or job.exception():
+        flash("The PDF report is not available."); return redirect(url_for('main_page'))
+    return Response(job.result(), mimetype='application/pdf', headers={'Content-Disposition': 'attachment;filename=dyno_report.pdf'})
 
 def main_cli():
     # This function remains unchanged, but won't use the new metadata fields.
@@ -165,7 +317,7 @@ def main_cli():
     args = parser.parse_args()
     if args.filepaths:
         try:
-            with open(args.filepaths[0], 'r') as f: main_data = process_file_content(f.read(), args.filepaths[0])
+            with open(args.filepaths[0], 'rb') as f: main_data = process_file_cached(f, args.filepaths[0])
             if not main_data: print(f"Critical Error: Failed to parse main file: {args.filepaths[0]}."); return
             
             # Add default meta for command-line usage
@@ -173,7 +325,7 @@ def main_cli():
             CMD_FILE_DATA = {"main_run": main_data, "comparison_run": None, "meta": default_meta}
 
             if len(args.filepaths) > 1:
-                with open(args.filepaths[1], 'r') as f: CMD_FILE_DATA["comparison_run"] = process_file_content(f.read(), args.filepaths[1])
+                with open(args.filepaths[1], 'rb') as f: CMD_FILE_DATA["comparison_run"] = process_file_cached(f, args.filepaths[1])
             
             Timer(1, lambda: webbrowser.open_new("http://127.0.0.1:5000/")).start()
         except Exception as e: 
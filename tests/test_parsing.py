@@ -0,0 +1,93 @@
+import io
+import os
+import re
+import sys
+import json
+
+import numpy as np
+import pytest
+from flask import get_flashed_messages
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app  # noqa: E402
+
+# Rows, bins and peaks produced by the original row-by-row parser for each case below.
+with open(os.path.join(os.path.dirname(__file__), 'baseline_expected.json')) as f:
+    BASELINE = json.load(f)
+
+
+def read_sample(name):
+    with open(os.path.join(ROOT, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def truncate_first_data_row(content):
+    """ Replaces the first curve fit row with a 5-field row, which has to be skipped. """
+    lines = content.split('\n')
+    first = next(i for i, line in enumerate(lines) if line.startswith('Time_(Sec)')) + 1
+    lines[first] = '0 1,2 3 4,5 6'
+    return '\n'.join(lines)
+
+
+def corrupt_one_row(content):
+    """ Puts a non-numeric RPM value into one curve fit row above 5500 RPM. """
+    lines = content.split('\n')
+    lines[69] = re.sub(r' [0-9,]+ 0 0 0 ', ' garbage 0 0 0 ', lines[69], count=1)
+    return '\n'.join(lines)
+
+
+def indent_markers(content):
+    """ Indents both section markers and the column row. """
+    return re.sub(r'^(PRIMARY_CHANNEL_CURVE_FIT_DATA|FULL_SET_COAST_DOWN_FIT_DATA|Time_\(Sec\) RPM1_Roller_\(rad/s\) RPM1_Wheel)',
+                  r'   \1', content, flags=re.M)
+
+
+CASES = {
+    'test1.sdp': lambda: read_sample('test1.sdp'),
+    'test2.sdp': lambda: read_sample('test2.sdp'),
+    'short_first_row': lambda: truncate_first_data_row(read_sample('test1.sdp')),
+    'malformed_value': lambda: corrupt_one_row(read_sample('test1.sdp')),
+    'indented_markers': lambda: indent_markers(read_sample('test1.sdp')),
+    'dot_decimal': lambda: read_sample('test1.sdp').replace(',', '.'),
+    'crlf': lambda: read_sample('test1.sdp').replace('\n', '\r\n'),
+}
+
+
+def process(content, filename):
+    with app.app.test_request_context():
+        return app.process_file_content(io.BytesIO(content.encode('utf-8')), filename)
+
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_matches_baseline(case):
+    result = process(CASES[case](), case)
+    expected = BASELINE[case]
+    assert result['raw_data'] == expected['raw_data']
+    assert result['aggregated_data'] == expected['aggregated_data']
+    assert result['peak_power'] == expected['peak_power']
+    assert result['peak_torque'] == expected['peak_torque']
+    assert result['data_points_count'] == expected['data_points_count']
+    assert result['config'] == expected['config']
+    chart = result['chart']
+    assert chart['rpm'].tolist() == [row['rpm'] for row in expected['raw_data']]
+    assert chart['torque'].tolist() == [row['torque'] for row in expected['raw_data']]
+    assert chart['hp'].tolist() == [row['hp'] for row in expected['raw_data']]
+
+
+def test_missing_column_row_reports_no_data():
+    content = re.sub(r'^Time_\(Sec\) RPM1_Roller_\(rad/s\) RPM1_Wheel.*\n', '', read_sample('test1.sdp'), count=1, flags=re.M)
+    with app.app.test_request_context():
+        assert app.process_file_content(io.BytesIO(content.encode('utf-8')), 'no_columns.sdp') is None
+        assert get_flashed_messages() == ["Parsing complete, but no data points were found above 5500 RPM."]
+
+
+def test_round2_matches_python_round_on_ties():
+    values = np.concatenate([np.arange(0, 20, 0.005), np.array([7.405, 5.945, 6.715, 2.675, 1.005])])
+    assert app.round2(values).tolist() == [round(v, 2) for v in values.tolist()]
+
+
+def test_read_until_marker_across_chunks():
+    text = 'a b\n  c d\n \tFULL_SET_COAST_DOWN_FIT_DATA\nraw'
+    for chunk_size in (1, 5, 64):
+        assert app.read_until_marker(io.StringIO(text), 'FULL_SET_COAST_DOWN_FIT_DATA', chunk_size) == 'a b\n  c d\n'